@@ -1,8 +1,18 @@
 import streamlit as st
 import pandas as pd
+import numpy as np
 from datetime import datetime, timedelta
 import plotly.express as px
 import io
+import os
+import calendar
+import html
+import glob
+import hashlib
+import tempfile
+import requests
+from requests.adapters import HTTPAdapter
+from concurrent.futures import ThreadPoolExecutor
 
 # --- 頁面設定 (Page Configuration) ---
 st.set_page_config(
@@ -11,57 +21,162 @@ st.set_page_config(
     layout="wide"
 )
 
+# 解析後的 Excel 資料以 Parquet 格式快取於此目錄
+CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.cache')
+# 解析流程有未反映於讀取參數的變更時 (例如更換讀取引擎) 需遞增此版本，使舊快取失效
+CACHE_VERSION = 1
+
+# 帳齡對應的邊框與背景顏色 (視覺區分度較高的色系)
+# Aging 已於載入時正規化為大寫，'_M6' 用於所有含 M6 的帳齡 (如 M6+A)，'_DEFAULT' 用於其餘帳齡
+AGING_COLORS = {
+    'M2': {'border': "#FBBF24", 'bg': "rgba(251, 191, 36, 0.15)"},  # 黃色
+    'M3': {'border': "#F97316", 'bg': "rgba(249, 115, 22, 0.15)"},  # 橘色
+    'M4': {'border': "#EF4444", 'bg': "rgba(239, 68, 68, 0.15)"},   # 紅色
+    'M5': {'border': "#BE123C", 'bg': "rgba(190, 18, 60, 0.15)"},   # 深紅色/玫瑰紅
+    '_M6': {'border': "#86198F", 'bg': "rgba(134, 25, 143, 0.15)"}, # 紫色 (最高警示)
+    '_DEFAULT': {'border': "#6B7280", 'bg': "rgba(107, 114, 128, 0.1)"}, # 灰色
+}
+
 # --- 核心功能函式 (Core Functions) ---
 
+def get_aging_colors(aging_status):
+    """根據 (已正規化的) Aging 狀態返回邊框和背景的顏色"""
+    return AGING_COLORS.get(aging_status) or AGING_COLORS['_M6' if 'M6' in aging_status else '_DEFAULT']
+
+def get_gdrive_file_id(share_link):
+    """從 Google Drive 分享連結中取出檔案 ID"""
+    if 'spreadsheets/d/' in share_link or 'file/d/' in share_link:
+        return share_link.split('/d/')[1].split('/')[0]
+    return None
+
 def get_gdrive_download_url(share_link):
     """將 Google Drive 分享連結轉換為直接下載連結"""
-    file_id = None
+    file_id = get_gdrive_file_id(share_link)
     if 'spreadsheets/d/' in share_link:
-        file_id = share_link.split('/d/')[1].split('/')[0]
         return f'https://docs.google.com/spreadsheets/d/{file_id}/export?format=xlsx'
     elif 'file/d/' in share_link:
-        file_id = share_link.split('/d/')[1].split('/')[0]
         return f'https://drive.google.com/uc?export=download&id={file_id}'
     
     st.warning(f"提供的連結格式不正確，請確認是有效的 Google Drive 檔案分享連結: {share_link}")
     return None
 
+def read_excel_file(source, **kwargs):
+    """以 calamine 引擎讀取 Excel，若環境未安裝 python-calamine 則退回 openpyxl"""
+    try:
+        return pd.read_excel(source, engine='calamine', **kwargs)
+    except ImportError:
+        return pd.read_excel(source, engine='openpyxl', **kwargs)
+
+@st.cache_resource # 跨重新執行共用同一個連線池
+def get_http_session():
+    """建立共用的 HTTP 連線池，兩個檔案的下載可重複使用連線"""
+    session = requests.Session()
+    session.mount('https://', HTTPAdapter(pool_connections=4, pool_maxsize=4))
+    return session
+
+def download_file(download_url):
+    """下載檔案並返回其二進位內容"""
+    response = get_http_session().get(download_url, timeout=60)
+    response.raise_for_status()
+    return response.content
+
+def read_excel_cached(file_id, content_md5, content, usecols=None, **kwargs):
+    """
+    讀取已下載的 Excel 檔案內容，解析結果以 Parquet 快取於磁碟。
+    快取鍵值為 檔案 ID + 檔案內容 MD5 + 讀取參數摘要，檔案或讀取參數變更後會自動重新解析。
+    - usecols: 欲讀取的欄位名稱清單，比對時會忽略表頭前後空白
+    """
+    read_options = repr((CACHE_VERSION, usecols, sorted(kwargs.items())))
+    options_digest = hashlib.md5(read_options.encode('utf-8')).hexdigest()[:8]
+    cache_path = os.path.join(CACHE_DIR, f"{file_id}-{content_md5}-{options_digest}.parquet")
+    if os.path.exists(cache_path):
+        # 快取檔損毀 (例如寫入中斷) 時刪除該檔，改為重新解析 Excel
+        try:
+            return pd.read_parquet(cache_path, engine='pyarrow')
+        except Exception:
+            try:
+                os.remove(cache_path)
+            except OSError:
+                pass
+
+    if usecols is not None:
+        wanted_cols = set(usecols)
+        kwargs['usecols'] = lambda col: str(col).strip() in wanted_cols
+    df = read_excel_file(io.BytesIO(content), **kwargs)
+
+    # 快取寫入失敗 (例如唯讀環境或欄位型別混雜) 不影響資料載入
+    # 每次寫入使用各自的暫存檔，避免同時載入的程序互相覆蓋未寫完的檔案
+    tmp_path = None
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        for stale_path in glob.glob(os.path.join(CACHE_DIR, f"{file_id}-*.parquet")):
+            os.remove(stale_path)
+        tmp_fd, tmp_path = tempfile.mkstemp(dir=CACHE_DIR, suffix='.parquet')
+        os.close(tmp_fd)
+        df.to_parquet(tmp_path, engine='pyarrow', compression='zstd')
+        os.replace(tmp_path, cache_path)
+    except Exception:
+        if tmp_path and os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return df
+
 @st.cache_data # 使用快取加速資料讀取
 def load_data_from_gdrive(visit_url, group_url):
     """
     從 Google Drive 分享連結讀取並處理指定的 Excel 檔案。
     - visit_url: KH_DM_COLL_REPOSN_VISIT.xlsx 的分享連結
     - group_url: 分組名單.xlsx 的分享連結
-    返回: 處理完成的 visit_logs (DataFrame) 和 groups_info (DataFrame)
+    返回: 處理完成的 visit_logs (DataFrame)、groups_info (DataFrame) 及資料版本識別碼 data_sig (str)
     """
     visit_download_url = get_gdrive_download_url(visit_url)
     group_download_url = get_gdrive_download_url(group_url)
 
     if not visit_download_url or not group_download_url:
-        return None, None
+        return None, None, None
 
     try:
-        groups_df = pd.read_excel(group_download_url)
+        # 兩個檔案同時下載；先於主執行緒建立連線池，下載執行緒僅取用已快取的連線池
+        get_http_session()
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            visit_future = executor.submit(download_file, visit_download_url)
+            group_future = executor.submit(download_file, group_download_url)
+            visit_content = visit_future.result()
+            group_content = group_future.result()
+
+        visit_md5 = hashlib.md5(visit_content).hexdigest()
+        group_md5 = hashlib.md5(group_content).hexdigest()
+        # 兩個檔案內容皆未變動時 data_sig 不變，供下游的快取函式辨識資料版本
+        data_sig = f"{visit_md5}-{group_md5}"
+
+        groups_df = read_excel_cached(get_gdrive_file_id(group_url), group_md5, group_content, dtype='string[pyarrow]')
         groups_df.columns = groups_df.columns.str.strip()
-        groups_df['ID'] = groups_df['ID'].astype(str).str.strip()
+        groups_df['ID'] = groups_df['ID'].str.strip()
         
         if 'Collector' in groups_df.columns and 'Agent Name' not in groups_df.columns:
             groups_df.rename(columns={'Collector': 'Agent Name'}, inplace=True)
 
-        collectors_info = groups_df.set_index('ID')['Agent Name'].to_dict()
-
-        visit_logs_df = pd.read_excel(visit_download_url, header=1)
+        required_cols = ['Collector', 'Create Time', 'Neg Pos Unit', 'Aging', 'Contact Summary', 'Customer Name']
+        text_cols = ['Collector', 'Neg Pos Unit', 'Aging', 'Contact Summary', 'Customer Name']
+
+        # 只解析需要的欄位，文字欄位直接以字串讀入以略過型別推斷
+        # 使用 PyArrow 字串型別，後續的 strip / split / upper 等字串處理皆由 Arrow 原生運算執行
+        # Create Time 不指定型別：儲存格若為真正的日期，保留原始日期值交由下方 to_datetime 處理
+        visit_logs_df = read_excel_cached(
+            get_gdrive_file_id(visit_url),
+            visit_md5,
+            visit_content,
+            header=1,
+            usecols=required_cols,
+            dtype={col: 'string[pyarrow]' for col in text_cols},
+        )
         visit_logs_df.columns = visit_logs_df.columns.str.strip()
 
-        required_cols = ['Collector', 'Create Time', 'Neg Pos Unit', 'Aging', 'Contact Summary', 'Customer Name']
         if not all(col in visit_logs_df.columns for col in required_cols):
             st.error("外訪紀錄檔缺少必要的欄位，請確認檔案包含：'Collector', 'Create Time', 'Neg Pos Unit', 'Aging', 'Contact Summary', 'Customer Name'")
-            return None, None
-            
-        visit_logs_df = visit_logs_df[required_cols].copy()
+            return None, None, None
 
         visit_logs_df.dropna(subset=['Create Time', 'Collector', 'Aging'], inplace=True)
-        visit_logs_df['Collector'] = visit_logs_df['Collector'].astype(str).str.strip()
+        visit_logs_df['Collector'] = visit_logs_df['Collector'].str.strip()
         
         visit_logs_df['Collector ID'] = visit_logs_df['Collector'].str.split('-').str[0].str.strip()
         
@@ -69,87 +184,188 @@ def load_data_from_gdrive(visit_url, group_url):
         visit_logs_df = visit_logs_df[visit_logs_df['Collector ID'].isin(valid_collector_ids)]
 
         if 'Neg Pos Unit' in visit_logs_df.columns:
-            visit_logs_df['Neg Pos Unit'] = visit_logs_df['Neg Pos Unit'].astype(str)
-            visit_logs_df = visit_logs_df[visit_logs_df['Neg Pos Unit'].str.strip() != 'CancelRepossession']
+            visit_logs_df = visit_logs_df[~visit_logs_df['Neg Pos Unit'].str.strip().isin(['CancelRepossession'])]
 
-        visit_logs_df['Create Time'] = pd.to_datetime(visit_logs_df['Create Time'], format='%d/%m/%Y %H:%M:%S', errors='coerce')
+        # cache=True 讓重複的時間字串只解析一次
+        visit_logs_df['Create Time'] = pd.to_datetime(visit_logs_df['Create Time'], format='%d/%m/%Y %H:%M:%S', errors='coerce', cache=True)
         visit_logs_df.dropna(subset=['Create Time'], inplace=True)
-        visit_logs_df['Date'] = visit_logs_df['Create Time'].dt.date
-
-        visit_logs_df['Collector Name'] = visit_logs_df['Collector ID'].map(collectors_info)
-        group_map = groups_df.set_index('ID')['Group'].to_dict()
-        visit_logs_df['Group'] = visit_logs_df['Collector ID'].map(group_map)
+        # 保留 datetime64 型別 (僅去除時間部分)，避免產生 Python date 物件
+        visit_logs_df['Date'] = visit_logs_df['Create Time'].dt.normalize()
+
+        # 一次合併取得姓名與團隊 (重複的 ID 以最後一筆為準)
+        collector_lookup = (
+            groups_df[['ID', 'Agent Name', 'Group']]
+            .drop_duplicates('ID', keep='last')
+            .rename(columns={'ID': 'Collector ID', 'Agent Name': 'Collector Name'})
+        )
+        visit_logs_df = visit_logs_df.merge(collector_lookup, on='Collector ID', how='left')
+        # 分組名單中無對應姓名時沿用原始 Collector 欄位
+        visit_logs_df['Collector Name'] = visit_logs_df['Collector Name'].fillna(visit_logs_df['Collector'])
+        # 卡片上顯示的簡短姓名 (去除 ID 前綴)
+        visit_logs_df['Collector Short Name'] = visit_logs_df['Collector Name'].str.split('-').str[-1]
+        groups_df['Agent Short Name'] = groups_df['Agent Name'].str.split('-').str[-1]
         
-        visit_logs_df['Aging'] = visit_logs_df['Aging'].astype(str).str.strip().str.upper()
-        
-        return visit_logs_df, groups_df
+        visit_logs_df['Aging'] = visit_logs_df['Aging'].str.strip().str.upper()
+        # 預先計算帳齡排序值，各視圖直接使用，不需每次重新以正規表示式解析
+        visit_logs_df['AgingSort'] = pd.to_numeric(visit_logs_df['Aging'].str.extract(r'(\d+)', expand=False), errors='coerce').fillna(0).astype('int8')
+
+        # 僅用於卡片顯示的欄位：預先補上缺值並完成 HTML 跳脫，卡片渲染時直接套用
+        visit_logs_df.fillna({'Customer Name': 'N/A', 'Contact Summary': '無摘要資訊'}, inplace=True)
+        for col in ('Customer Name', 'Contact Summary', 'Collector Short Name'):
+            visit_logs_df[col] = visit_logs_df[col].map(html.escape)
+        visit_logs_df['Contact Summary'] = visit_logs_df['Contact Summary'].str.replace('\n', '<br>', regex=False)
+
+        # 低基數的文字欄位轉為類別型別，節省記憶體並加速篩選比對
+        for col in ('Group', 'Aging', 'Collector ID', 'Collector Name', 'Collector Short Name', 'Neg Pos Unit'):
+            visit_logs_df[col] = visit_logs_df[col].astype('category')
+        groups_df['Group'] = groups_df['Group'].astype('category')
+        groups_df['ID'] = groups_df['ID'].astype('category')
+
+        # 依日期排序並設為索引 (保留 Date 欄位)，日期區間篩選可直接以 .loc 切片
+        # 索引不命名，避免與 Date 欄位同名造成 groupby('Date') 判斷歧義
+        visit_logs_df = visit_logs_df.sort_values('Date', kind='stable').set_index('Date', drop=False).rename_axis(None)
+
+        return visit_logs_df, groups_df, data_sig
 
     except Exception as e:
         st.error(f"讀取 Google Drive 檔案時發生錯誤，請檢查連結權限或檔案格式。")
         st.error(f"詳細錯誤訊息：{e}")
-        return None, None
-
-def get_aging_colors(aging_status):
-    """根據 Aging 狀態返回邊框和背景的顏色 (全新色系)"""
-    default_colors = {'border': "#6B7280", 'bg': "rgba(107, 114, 128, 0.1)"} # 灰色
-    if not isinstance(aging_status, str):
-        return default_colors
+        return None, None, None
 
-    aging_status = aging_status.strip().upper()
-    
-    # --- 修改：採用視覺區分度更高的全新色系 ---
-    color_map = {
-        'M2': {'border': "#FBBF24", 'bg': "rgba(251, 191, 36, 0.15)"},  # 黃色
-        'M3': {'border': "#F97316", 'bg': "rgba(249, 115, 22, 0.15)"},  # 橘色
-        'M4': {'border': "#EF4444", 'bg': "rgba(239, 68, 68, 0.15)"},   # 紅色
-        'M5': {'border': "#BE123C", 'bg': "rgba(190, 18, 60, 0.15)"},   # 深紅色/玫瑰紅
-    }
-    
-    if 'M6' in aging_status:
-        return {'border': "#86198F", 'bg': "rgba(134, 25, 143, 0.15)"} # 紫色 (最高警示)
-    
-    return color_map.get(aging_status, default_colors)
-
-def display_case_card(row):
-    """顯示單一案件卡片"""
+def build_case_card_html(row):
+    """產生單一案件卡片的 HTML (摘要以 <details> 收合)"""
     colors = get_aging_colors(row['Aging'])
     border_color = colors['border']
     bg_color = colors['bg']
-    
-    with st.container():
-        st.markdown(f"""
-        <div style="border-left: 5px solid {border_color}; border-radius: 5px; padding: 10px; background-color: {bg_color}; margin-bottom: 8px; box-shadow: 0 1px 3px 0 rgba(0, 0, 0, 0.05);">
-            <p style="font-weight: bold; color: #111827; margin: 0; white-space: nowrap; overflow: hidden; text-overflow: ellipsis;" title="{row['Customer Name']}">
-                {row['Customer Name'] if pd.notna(row['Customer Name']) else 'N/A'}
-            </p>
-            <div style="display: flex; justify-content: space-between; font-size: 0.8em; color: #4B5563; margin-top: 4px;">
-                <span style="font-weight: bold; color: {border_color};">Aging: {row['Aging'] if pd.notna(row['Aging']) else 'N/A'}</span>
-                <span title="{row['Collector Name'] if pd.notna(row['Collector Name']) else row['Collector']}">
-                    {row['Collector Name'].split('-')[-1] if pd.notna(row['Collector Name']) else row['Collector']}
-                </span>
-            </div>
-        </div>
-        """, unsafe_allow_html=True)
-        
-        with st.expander("View Summary"):
-            st.markdown(f"**紀錄時間 (Time):** `{row['Create Time'].strftime('%Y-%m-%d %H:%M:%S')}`")
-            st.markdown(f"**案件資訊 (Case Info):** `Aging: {row['Aging']} | Unit: {row['Neg Pos Unit']}`")
-            st.markdown("**催收摘要 (Contact Summary):**")
-            st.info(f"{row['Contact Summary'] if pd.notna(row['Contact Summary']) else '無摘要資訊'}")
-
-def get_heatmap_color(count, max_count):
-    """計算月曆熱力圖顏色"""
-    if count == 0:
-        return "#F3F4F6"
-    normalized = (count / (max_count or 1)) * 0.9 + 0.1 
+
+    # Customer Name、Contact Summary、Collector Short Name 已於載入時補值並完成 HTML 跳脫
+    customer_name = row['Customer Name']
+    aging = html.escape(row['Aging'])
+    collector_title = html.escape(row['Collector Name'])
+    unit = html.escape(str(row['Neg Pos Unit']))
+
+    # 整段 HTML 不可包含空行，否則 Markdown 會提前結束 HTML 區塊
+    return f"""<div style="border-left: 5px solid {border_color}; border-radius: 5px; padding: 10px; background-color: {bg_color}; margin-bottom: 8px; box-shadow: 0 1px 3px 0 rgba(0, 0, 0, 0.05);">
+<p style="font-weight: bold; color: #111827; margin: 0; white-space: nowrap; overflow: hidden; text-overflow: ellipsis;" title="{customer_name}">{customer_name}</p>
+<div style="display: flex; justify-content: space-between; font-size: 0.8em; color: #4B5563; margin-top: 4px;">
+<span style="font-weight: bold; color: {border_color};">Aging: {aging}</span>
+<span title="{collector_title}">{row['Collector Short Name']}</span>
+</div>
+<details style="margin-top: 6px; font-size: 0.85em;">
+<summary style="cursor: pointer;">View Summary</summary>
+<p style="margin: 6px 0 0 0;"><b>紀錄時間 (Time):</b> <code>{row['Create Time'].strftime('%Y-%m-%d %H:%M:%S')}</code></p>
+<p style="margin: 4px 0 0 0;"><b>案件資訊 (Case Info):</b> <code>Aging: {aging} | Unit: {unit}</code></p>
+<p style="margin: 4px 0 0 0;"><b>催收摘要 (Contact Summary):</b></p>
+<div style="background-color: rgba(28, 131, 225, 0.1); color: #004280; border-radius: 5px; padding: 8px; margin-top: 4px;">{row['Contact Summary']}</div>
+</details>
+</div>"""
+
+def build_week_header_html(days_of_week, day_counts, today):
+    """產生週視圖七天的表頭 (星期、日期與案件數)，以單一 HTML grid 輸出"""
+    cells = []
+    for day, count in zip(days_of_week, day_counts):
+        is_today = (day == today)
+        cells.append(f"""<div style="text-align: center;">
+<p style="font-weight: bold; background-color: {"#1E40AF" if is_today else "#D1D5DB"}; color: {"white" if is_today else "black"}; padding: 5px; border-radius: 5px; margin-bottom: 8px;">{day.strftime('%A')}<br>{day.strftime('%m/%d')}</p>
+<div style="font-size: 0.875rem; color: #4B5563;">案件數</div>
+<div style="font-size: 2.25rem; line-height: 1.4;">{count}</div>
+</div>""")
+    return (
+        '<div style="display: grid; grid-template-columns: repeat(7, 1fr); gap: 1rem; '
+        'border-bottom: 1px solid #D1D5DB; padding-bottom: 12px; margin-bottom: 16px;">\n'
+        + "\n".join(cells)
+        + "\n</div>"
+    )
+
+def build_month_calendar_html(calendar_days, in_month, counts, colors, today):
+    """產生整個月曆 (星期表頭與所有日期格子) 的 HTML grid"""
+    day_names = ['週一', '週二', '週三', '週四', '週五', '週六', '週日']
+    cells = [f"<h5 style='text-align: center; margin: 0;'>{name}</h5>" for name in day_names]
+    for current_day, is_in_month, count, color in zip(calendar_days, in_month, counts, colors):
+        if is_in_month:
+            border_style = "2px solid #1E40AF" if current_day == today else "1px solid #D1D5DB"
+            cells.append(f"""<div style="background-color: {color}; border: {border_style}; border-radius: 8px; padding: 10px; height: 120px; display: flex; flex-direction: column; justify-content: space-between;">
+<span style="font-weight: bold; text-align: left;">{current_day.day}</span>
+<span style="font-size: 1.5em; font-weight: bold; text-align: center;">{count}</span>
+</div>""")
+        else:
+            cells.append(f"""<div style="background-color: #F9FAFB; border: 1px solid #E5E7EB; border-radius: 8px; padding: 10px; height: 120px;">
+<span style="color: #9CA3AF;">{current_day.day}</span>
+</div>""")
+    return (
+        '<div style="display: grid; grid-template-columns: repeat(7, 1fr); gap: 1rem; margin-bottom: 16px;">\n'
+        + "\n".join(cells)
+        + "\n</div>"
+    )
+
+def get_aging_counts(data):
+    """統計各帳齡的案件數 (依帳齡排序)，並附上圖表用的顏色"""
+    aging_counts = data.groupby(['AgingSort', 'Aging'], observed=True).size().reset_index(name='Count')
+    aging_counts['Aging'] = aging_counts['Aging'].astype(str)
+    aging_counts['Color'] = aging_counts['Aging'].map(lambda aging: get_aging_colors(aging)['border'])
+    return aging_counts
+
+@st.cache_data(max_entries=256) # 每組 (催收員, 日期區間) 各佔一筆，限制筆數避免記憶體無限成長
+def get_collector_aging_counts(_visit_logs, data_sig, collector_name, start_date, end_date):
+    """
+    統計單一催收員在指定期間內各帳齡的案件數。
+    _visit_logs 不參與快取鍵值的雜湊，改以 data_sig 辨識資料版本。
+    """
+    period_data = _visit_logs.loc[pd.Timestamp(start_date):pd.Timestamp(end_date)]
+    collector_data = period_data[period_data['Collector Name'] == collector_name]
+    return get_aging_counts(collector_data)
+
+@st.cache_data
+def get_group_options(_groups_info, data_sig):
+    """側邊欄「選擇團隊」的選項清單"""
+    return ['所有團隊'] + sorted(_groups_info['Group'].unique().tolist())
+
+@st.cache_data
+def get_collector_options(_visit_logs, _groups_info, data_sig, group):
+    """側邊欄「選擇催收員」的選項清單，依所選團隊而定"""
+    if group == '所有團隊':
+        return ['所有催收員'] + sorted(_groups_info['Agent Name'].unique().tolist())
+    collector_ids_in_group = _groups_info[_groups_info['Group'] == group]['ID'].tolist()
+    filtered_collectors = _visit_logs[_visit_logs['Collector ID'].isin(collector_ids_in_group)]
+    return ['所有催收員'] + sorted(filtered_collectors['Collector Name'].dropna().unique().tolist())
+
+@st.cache_data
+def get_comparison_options(_groups_info, data_sig, group):
+    """
+    行為模式比較頁的催收員選項清單。
+    返回: (選項清單, 選項 -> Agent Name 的對照表)
+    """
+    if group == '所有團隊':
+        formatted_names = "[" + _groups_info['Group'].astype(str) + "] " + _groups_info['Agent Name']
+        collector_options = sorted(formatted_names.unique().tolist())
+        name_map = dict(zip(formatted_names, _groups_info['Agent Name']))
+    else:
+        team_members = _groups_info[_groups_info['Group'] == group]
+        collector_options = sorted(team_members['Agent Name'].unique().tolist())
+        name_map = {name: name for name in collector_options}
+    return collector_options, name_map
+
+def get_heatmap_colors(counts, max_count):
+    """計算月曆熱力圖顏色 (一次計算整個月曆的所有格子)"""
+    normalized = (counts / (max_count or 1)) * 0.9 + 0.1
     lightness = 95 - (normalized * 55)
-    return f"hsl(220, 80%, {lightness}%)"
+    hsl_colors = np.char.add(np.char.add("hsl(220, 80%, ", lightness.astype(str)), "%)")
+    return np.where(counts == 0, "#F3F4F6", hsl_colors)
 
 def switch_to_week_view(date_to_view):
     """切換至週視圖的回呼函式"""
     st.session_state.current_date = date_to_view
     st.session_state.view_mode = '週'
 
+def switch_to_selected_week(day_select_key):
+    """月視圖表單送出時的回呼函式：切換至所選日期的週視圖"""
+    switch_to_week_view(st.session_state[day_select_key])
+
+def reset_analysis_dates():
+    """側邊欄篩選變更時的回呼函式：清除分析日期，使其依新的篩選資料重新設定預設值"""
+    st.session_state.pop('analysis_start', None)
+    st.session_state.pop('analysis_end', None)
+
 
 # --- 主應用程式介面 (Main App Interface) ---
 st.title("📊 催收人員行為儀表板")
@@ -183,36 +399,39 @@ GDRIVE_GROUP_URL = "您的分組名單檔案分享連結"
 
     st.header("篩選條件")
     
-    visit_logs, groups_info = load_data_from_gdrive(visit_log_url, group_list_url)
+    visit_logs, groups_info, data_sig = load_data_from_gdrive(visit_log_url, group_list_url)
 
     if visit_logs is None or groups_info is None:
         st.warning("資料載入失敗，請檢查儀表板上方的錯誤訊息。")
         st.stop()
 
-    group_list = ['所有團隊'] + sorted(groups_info['Group'].unique().tolist())
-    selected_group = st.selectbox('選擇團隊 (Group)', group_list)
+    group_list = get_group_options(groups_info, data_sig)
+    selected_group = st.selectbox('選擇團隊 (Group)', group_list, on_change=reset_analysis_dates)
 
-    if selected_group == '所有團隊':
-        collectors_in_group = ['所有催收員'] + sorted(groups_info['Agent Name'].unique().tolist())
-    else:
-        collector_ids_in_group = groups_info[groups_info['Group'] == selected_group]['ID'].tolist()
-        filtered_collectors = visit_logs[visit_logs['Collector ID'].isin(collector_ids_in_group)]
-        collectors_in_group = ['所有催收員'] + sorted(filtered_collectors['Collector Name'].dropna().unique().tolist())
-        
-    selected_collector_name = st.selectbox('選擇催收員 (Collector)', collectors_in_group)
+    collectors_in_group = get_collector_options(visit_logs, groups_info, data_sig, selected_group)
+    selected_collector_name = st.selectbox('選擇催收員 (Collector)', collectors_in_group, on_change=reset_analysis_dates)
 
 # --- 主面板 (Main Panel) ---
 if visit_logs is not None and groups_info is not None:
-    base_filtered_data = visit_logs.copy()
+    # 不另行複製：未套用篩選時直接沿用 visit_logs，布林篩選本身即會產生新的 DataFrame
+    base_filtered_data = visit_logs
     if selected_group != '所有團隊':
         base_filtered_data = base_filtered_data[base_filtered_data['Group'] == selected_group]
     if selected_collector_name != '所有催收員':
         base_filtered_data = base_filtered_data[base_filtered_data['Collector Name'] == selected_collector_name]
 
-    tab1, tab2, tab3 = st.tabs(["🗓️ 行為追蹤", "📈 個人績效", "📊 行為模式比較"])
+    # 未顯示頁面上的元件不會被渲染，Streamlit 會清除其狀態；
+    # 每次重跑時重新指定這些鍵值，使切換頁面後仍保留使用者的選擇
+    for widget_key in ('view_mode', 'analysis_start', 'analysis_end', 'primary_collector', 'comparison_group', 'comp_start', 'comp_end'):
+        if widget_key in st.session_state:
+            st.session_state[widget_key] = st.session_state[widget_key]
+
+    # 以單選按鈕切換頁面，只執行目前頁面的程式碼 (st.tabs 每次重跑都會計算所有分頁)
+    tab_names = ["🗓️ 行為追蹤", "📈 個人績效", "📊 行為模式比較"]
+    selected_tab = st.radio("切換頁面", tab_names, key='active_tab', horizontal=True, label_visibility="collapsed")
 
     # --- 行為追蹤 Tab ---
-    with tab1:
+    if selected_tab == tab_names[0]:
         st.radio("切換視圖", ('週', '月'), key='view_mode', horizontal=True, label_visibility="collapsed")
         
         if 'current_date' not in st.session_state:
@@ -250,25 +469,24 @@ if visit_logs is not None and groups_info is not None:
             col3.subheader(f"{start_of_week.strftime('%Y/%m/%d')} - {end_of_week.strftime('%Y/%m/%d')}")
             
             days_of_week = [start_of_week + timedelta(days=i) for i in range(7)]
+
+            # 只掃描一次資料：先取出本週資料並依帳齡排序，再依日期分組
+            week_slice = base_filtered_data.loc[pd.Timestamp(start_of_week):pd.Timestamp(end_of_week)]
+            week_slice = week_slice.sort_values('AgingSort', ascending=False, kind='stable')
+            by_date = dict(list(week_slice.groupby('Date', sort=False)))
+            empty_day = week_slice.iloc[0:0]
+            week_data = [by_date.get(pd.Timestamp(day), empty_day) for day in days_of_week]
+
+            # 七天的表頭一次輸出，下方的 st.columns 只用來放置各天的卡片
+            st.markdown(build_week_header_html(days_of_week, [len(day_data) for day_data in week_data], datetime.now().date()), unsafe_allow_html=True)
+
             day_cols = st.columns(7)
-            
-            for i, day in enumerate(days_of_week):
+            for i, day_data in enumerate(week_data):
                 with day_cols[i]:
-                    is_today = (day == datetime.now().date())
-                    header_html = f"""
-                    <p style='text-align: center; font-weight: bold; background-color: {"#1E40AF" if is_today else "#D1D5DB"}; color: {"white" if is_today else "black"}; padding: 5px; border-radius: 5px;'>
-                        {day.strftime('%A')}<br>{day.strftime('%m/%d')}
-                    </p>"""
-                    st.markdown(header_html, unsafe_allow_html=True)
-                    
-                    day_data = base_filtered_data[base_filtered_data['Date'] == day]
-                    st.metric(label="案件數", value=len(day_data))
-                    st.markdown("---")
-                    
                     if not day_data.empty:
-                        day_data['AgingSort'] = day_data['Aging'].str.extract('(\d+)').fillna(0).astype(int)
-                        for _, row in day_data.sort_values('AgingSort', ascending=False).iterrows():
-                            display_case_card(row)
+                        # 一天的所有卡片合併為單一 st.markdown 輸出，減少前端元件數量
+                        cards_html = "\n".join(build_case_card_html(row) for row in day_data.to_dict('records'))
+                        st.markdown(cards_html, unsafe_allow_html=True)
                     else:
                         st.caption("無紀錄")
 
@@ -276,61 +494,69 @@ if visit_logs is not None and groups_info is not None:
             current_month_date = st.session_state.current_date
             col3.subheader(f"{current_month_date.year}年 {current_month_date.month}月")
 
-            daily_counts = base_filtered_data[(base_filtered_data['Create Time'].dt.year == current_month_date.year) & (base_filtered_data['Create Time'].dt.month == current_month_date.month)].groupby('Date').size()
-            max_count = daily_counts.max() if not daily_counts.empty else 1
             first_day_of_month = current_month_date.replace(day=1)
             start_of_calendar = first_day_of_month - timedelta(days=first_day_of_month.weekday())
-            day_names = ['週一', '週二', '週三', '週四', '週五', '週六', '週日']
-            header_cols = st.columns(7)
-            for i, name in enumerate(day_names):
-                header_cols[i].markdown(f"<h5 style='text-align: center;'>{name}</h5>", unsafe_allow_html=True)
-            st.markdown("---", unsafe_allow_html=True)
-            current_day = start_of_calendar
-            while True:
-                week_cols = st.columns(7)
-                for i in range(7):
-                    with week_cols[i]:
-                        if current_day.month == current_month_date.month:
-                            count = daily_counts.get(current_day, 0)
-                            color = get_heatmap_color(count, max_count)
-                            is_today = (current_day == datetime.now().date())
-                            border_style = "2px solid #1E40AF" if is_today else "1px solid #D1D5DB"
-                            st.markdown(f"""
-                            <div style="background-color: {color}; border: {border_style}; border-radius: 8px; padding: 10px; height: 120px; display: flex; flex-direction: column; justify-content: space-between;">
-                                <span style="font-weight: bold; text-align: left;">{current_day.day}</span>
-                                <span style="font-size: 1.5em; font-weight: bold; text-align: center;">{count}</span>
-                            </div>""", unsafe_allow_html=True)
-                            st.button("檢視", key=f"view_btn_{current_day}", on_click=switch_to_week_view, args=(current_day,), use_container_width=True)
-                        else:
-                            st.markdown(f"""
-                            <div style="background-color: #F9FAFB; border: 1px solid #E5E7EB; border-radius: 8px; padding: 10px; height: 120px;">
-                                <span style="color: #9CA3AF;">{current_day.day}</span>
-                            </div>""", unsafe_allow_html=True)
-                            st.button(" ", key=f"view_btn_{current_day}", use_container_width=True, disabled=True)
-                    current_day += timedelta(days=1)
-                if current_day.month != current_month_date.month and current_day > first_day_of_month:
-                    break
+            days_in_month = calendar.monthrange(current_month_date.year, current_month_date.month)[1]
+
+            # 取出當月資料後，以「距離月初的天數」做一次 bincount 即可得到當月每日案件數
+            last_day_of_month = first_day_of_month.replace(day=days_in_month)
+            month_slice = base_filtered_data.loc[pd.Timestamp(first_day_of_month):pd.Timestamp(last_day_of_month)]
+            day_offsets = (month_slice['Date'].to_numpy(dtype='datetime64[D]') - np.datetime64(first_day_of_month, 'D')).astype(np.int64)
+            month_counts = np.bincount(day_offsets, minlength=days_in_month)
+            max_count = month_counts.max() or 1
+
+            # 一次準備好整個月曆的日期、案件數與顏色
+            leading_days = first_day_of_month.weekday()
+            num_weeks = -(-(leading_days + days_in_month) // 7)
+            calendar_dates = np.arange(np.datetime64(start_of_calendar), np.datetime64(start_of_calendar) + num_weeks * 7, dtype='datetime64[D]')
+            calendar_days = calendar_dates.astype(object)
+            in_month = calendar_dates.astype('datetime64[M]') == np.datetime64(first_day_of_month, 'M')
+            counts = np.zeros(len(calendar_dates), dtype=np.int64)
+            counts[leading_days:leading_days + days_in_month] = month_counts
+            colors = get_heatmap_colors(counts, max_count)
+            today = datetime.now().date()
+
+            # 整個月曆以單一 HTML grid 輸出
+            st.markdown(build_month_calendar_html(calendar_days, in_month, counts, colors, today), unsafe_allow_html=True)
+
+            # 以單一表單選擇日期並切換至週視圖，取代每個日期格子各自的按鈕
+            month_days = calendar_days[in_month].tolist()
+            month_day_counts = dict(zip(month_days, counts[in_month].tolist()))
+            day_select_key = f"calendar_day_{first_day_of_month:%Y_%m}"
+            with st.form("calendar_day_form", border=False):
+                form_col1, form_col2 = st.columns([3, 1])
+                form_col1.selectbox(
+                    "選擇日期",
+                    month_days,
+                    index=current_month_date.day - 1,
+                    format_func=lambda day: f"{day.strftime('%m/%d')} ({month_day_counts[day]} 件)",
+                    key=day_select_key,
+                    label_visibility="collapsed",
+                )
+                form_col2.form_submit_button("檢視該週", on_click=switch_to_selected_week, args=(day_select_key,), use_container_width=True)
 
     # --- 個人績效 Tab ---
-    with tab2:
+    if selected_tab == tab_names[1]:
         st.subheader("個人帳齡案件處理分佈")
+        # 預設值寫入 session_state 而非傳入 value=，避免與切換頁面時保留的狀態衝突
+        if 'analysis_start' not in st.session_state:
+            st.session_state.analysis_start = base_filtered_data['Date'].min().date()
+        if 'analysis_end' not in st.session_state:
+            st.session_state.analysis_end = base_filtered_data['Date'].max().date()
         col_start, col_end = st.columns(2)
         with col_start:
-            analysis_start_date = st.date_input("分析開始日期", value=base_filtered_data['Date'].min(), key="analysis_start")
+            analysis_start_date = st.date_input("分析開始日期", key="analysis_start")
         with col_end:
-            analysis_end_date = st.date_input("分析結束日期", value=base_filtered_data['Date'].max(), key="analysis_end")
+            analysis_end_date = st.date_input("分析結束日期", key="analysis_end")
         if analysis_start_date > analysis_end_date:
             st.error("錯誤：開始日期不能晚於結束日期。")
         else:
-            analysis_data = base_filtered_data[(base_filtered_data['Date'] >= analysis_start_date) & (base_filtered_data['Date'] <= analysis_end_date)]
+            analysis_data = base_filtered_data.loc[pd.Timestamp(analysis_start_date):pd.Timestamp(analysis_end_date)]
             if analysis_data.empty:
                 st.info("在選定的日期範圍內沒有找到任何案件紀錄。")
             else:
-                aging_counts = analysis_data['Aging'].value_counts().reset_index()
-                aging_counts.columns = ['Aging', 'Count']
-                aging_counts['AgingSort'] = aging_counts['Aging'].str.extract('(\d+)').fillna(0).astype(int)
-                aging_counts = aging_counts.sort_values('AgingSort')
-                aging_color_map = {aging: get_aging_colors(aging)['border'] for aging in aging_counts['Aging']}
+                aging_counts = get_aging_counts(analysis_data)
+                aging_color_map = dict(zip(aging_counts['Aging'], aging_counts['Color']))
                 chart_col1, chart_col2 = st.columns(2)
                 with chart_col1:
                     st.markdown("#### 案件組合佔比")
@@ -344,17 +570,10 @@ if visit_logs is not None and groups_info is not None:
                     st.plotly_chart(fig_bar, use_container_width=True, key="personal_bar_chart")
 
     # --- 行為模式比較 Tab ---
-    with tab3:
+    if selected_tab == tab_names[2]:
         st.subheader("個人與參照組行為模式對標")
         
-        if selected_group == '所有團隊':
-            groups_info['Formatted Name'] = "[" + groups_info['Group'] + "] " + groups_info['Agent Name']
-            collector_options = sorted(groups_info['Formatted Name'].unique().tolist())
-            name_map = groups_info.set_index('Formatted Name')['Agent Name'].to_dict()
-        else:
-            team_members = groups_info[groups_info['Group'] == selected_group]
-            collector_options = sorted(team_members['Agent Name'].unique().tolist())
-            name_map = {name: name for name in collector_options}
+        collector_options, name_map = get_comparison_options(groups_info, data_sig, selected_group)
 
         selector_col1, selector_col2 = st.columns(2)
         with selector_col1:
@@ -365,34 +584,33 @@ if visit_logs is not None and groups_info is not None:
             comparison_collectors_formatted = st.multiselect("選擇參照組 (Comparison Group)", comparison_options, key="comparison_group")
 
         primary_collector = name_map.get(primary_collector_formatted)
+        short_name_map = dict(zip(groups_info['Agent Name'], groups_info['Agent Short Name']))
         comparison_collectors = [name_map.get(c) for c in comparison_collectors_formatted]
 
+        if 'comp_start' not in st.session_state:
+            st.session_state.comp_start = visit_logs['Date'].min().date()
+        if 'comp_end' not in st.session_state:
+            st.session_state.comp_end = visit_logs['Date'].max().date()
         comp_col_start, comp_col_end = st.columns(2)
         with comp_col_start:
-            comp_start_date = st.date_input("比較開始日期", value=visit_logs['Date'].min(), key="comp_start")
+            comp_start_date = st.date_input("比較開始日期", key="comp_start")
         with comp_col_end:
-            comp_end_date = st.date_input("比較結束日期", value=visit_logs['Date'].max(), key="comp_end")
+            comp_end_date = st.date_input("比較結束日期", key="comp_end")
 
         if comp_start_date > comp_end_date:
             st.error("錯誤：開始日期不能晚於結束日期。")
         else:
-            comp_data = visit_logs[(visit_logs['Date'] >= comp_start_date) & (visit_logs['Date'] <= comp_end_date)]
-            
             st.markdown("---")
             display_col1, display_col2 = st.columns(2)
 
             with display_col1:
-                st.markdown(f"#### 基準對象: {primary_collector.split('-')[-1] if primary_collector else 'N/A'}")
+                st.markdown(f"#### 基準對象: {short_name_map.get(primary_collector, 'N/A')}")
                 if primary_collector:
-                    primary_data = comp_data[comp_data['Collector Name'] == primary_collector]
-                    if primary_data.empty:
+                    aging_counts_primary = get_collector_aging_counts(visit_logs, data_sig, primary_collector, comp_start_date, comp_end_date)
+                    if aging_counts_primary.empty:
                         st.info("基準對象在此期間無紀錄。")
                     else:
-                        aging_counts_primary = primary_data['Aging'].value_counts().reset_index()
-                        aging_counts_primary.columns = ['Aging', 'Count']
-                        aging_counts_primary['AgingSort'] = aging_counts_primary['Aging'].str.extract('(\d+)').fillna(0).astype(int)
-                        aging_counts_primary = aging_counts_primary.sort_values('AgingSort')
-                        aging_color_map = {aging: get_aging_colors(aging)['border'] for aging in aging_counts_primary['Aging']}
+                        aging_color_map = dict(zip(aging_counts_primary['Aging'], aging_counts_primary['Color']))
 
                         st.markdown("##### 案件組合佔比")
                         fig_pie_primary = px.pie(aging_counts_primary, names='Aging', values='Count', color='Aging', color_discrete_map=aging_color_map, hole=.3)
@@ -409,18 +627,16 @@ if visit_logs is not None and groups_info is not None:
                     st.info("請選擇至少一位催收員加入參照組以進行比較。")
                 else:
                     st.markdown(f"#### 參照組 ({len(comparison_collectors)}人) 平均表現")
-                    comparison_data = comp_data[comp_data['Collector Name'].isin(comparison_collectors)]
-                    
-                    if comparison_data.empty:
+                    # 逐人取用已快取的統計結果再加總，調整參照組成員時只需計算新加入的人
+                    aging_counts_comp = pd.concat(
+                        [get_collector_aging_counts(visit_logs, data_sig, collector, comp_start_date, comp_end_date) for collector in comparison_collectors]
+                    ).groupby(['AgingSort', 'Aging', 'Color'], as_index=False)['Count'].sum()
+
+                    if aging_counts_comp.empty:
                         st.info("參照組在此期間無紀錄。")
                     else:
-                        aging_counts_comp = comparison_data['Aging'].value_counts().reset_index()
-                        aging_counts_comp.columns = ['Aging', 'Count']
                         aging_counts_comp['Count'] = aging_counts_comp['Count'] / len(comparison_collectors)
-                        
-                        aging_counts_comp['AgingSort'] = aging_counts_comp['Aging'].str.extract('(\d+)').fillna(0).astype(int)
-                        aging_counts_comp = aging_counts_comp.sort_values('AgingSort')
-                        aging_color_map = {aging: get_aging_colors(aging)['border'] for aging in aging_counts_comp['Aging']}
+                        aging_color_map = dict(zip(aging_counts_comp['Aging'], aging_counts_comp['Color']))
 
                         st.markdown("##### 平均案件組合佔比")
                         fig_pie_comp = px.pie(aging_counts_comp, names='Aging', values='Count', color='Aging', color_discrete_map=aging_color_map, hole=.3)